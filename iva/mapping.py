@@ -108,20 +108,22 @@ def map_reads(reads_fwd, reads_rev, ref_fa, out_prefix, index_k=15, index_s=3, t
         os.unlink(fname)
 
 
+def _mpileup_strand_flags(rev=False, both_strands=False):
+    if both_strands:
+        return ''
+    elif rev:
+        return '--rf 0x10'
+    else:
+        return '--ff 0x10'
+
+
 def get_bam_region_coverage(bam, seqname, seq_length, rev=False, verbose=0, both_strands=False):
     assert os.path.exists(bam)
     assert os.path.exists(bam + '.bai')
     # mpileup only reports positions of non-zero coverage, so can't just
     # take its output. Need to add in the zero coverage bases
     cov = [0] * seq_length
-
-    if both_strands:
-        flags = ''
-    elif rev:
-        flags = '--rf 0x10'
-    else:
-        flags = '--ff 0x10'
-
+    flags = _mpileup_strand_flags(rev=rev, both_strands=both_strands)
     mpileup_cmd = 'samtools mpileup -r ' + seqname + ' ' + flags + ' ' + bam + ' | cut -f 2,4'
     if verbose >= 2:
         print('    get_bam_region_coverage:', mpileup_cmd)
@@ -134,6 +136,28 @@ def get_bam_region_coverage(bam, seqname, seq_length, rev=False, verbose=0, both
     return cov
 
 
+def get_bam_coverage(bam, seq_lengths, rev=False, verbose=0, both_strands=False):
+    '''Same as get_bam_region_coverage, but gets the coverage of every sequence
+       from one run of mpileup over the whole BAM file, instead of one run
+       per sequence. seq_lengths = dict of sequence name -> length.
+       Returns a dict of sequence name -> list of coverage'''
+    assert os.path.exists(bam)
+    cov = {name: [0] * length for name, length in seq_lengths.items()}
+    flags = _mpileup_strand_flags(rev=rev, both_strands=both_strands)
+    mpileup_cmd = 'samtools mpileup ' + flags + ' ' + bam + ' | cut -f 1,2,4'
+    if verbose >= 2:
+        print('    get_bam_coverage:', mpileup_cmd)
+    p = subprocess.Popen(mpileup_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+
+    for line in p.stdout:
+        seqname, pos, depth = line.rstrip('\n').split('\t')
+        cov[seqname][int(pos) - 1] = int(depth)
+
+    p.stdout.close()
+    p.wait()
+    return cov
+
+
 def _remove_indels(l, p_or_m):
     while True:
         try:
@@ -80,13 +80,21 @@ class NucmerHit:
         except:
             raise Error('Error reading this nucmer line:\n' + line)
 
+        # these are made by qry_coords() and ref_coords() when first needed
+        self._qry_coords = None
+        self._ref_coords = None
+
+
+    def _key(self):
+        return (self.ref_start, self.ref_end, self.qry_start, self.qry_end, self.hit_length_ref, self.hit_length_qry, self.percent_identity, self.ref_length, self.qry_length, self.frame, self.ref_name, self.qry_name)
+
 
     def __eq__(self, other):
-        return type(other) is type(self) and self.__dict__ == other.__dict__
+        return type(other) is type(self) and self._key() == other._key()
 
 
     def __hash__(self):
-        return hash((self.ref_start, self.ref_end, self.qry_start, self.qry_end, self.hit_length_ref, self.hit_length_qry, self.percent_identity, self.ref_length, self.qry_length, self.frame, self.ref_name, self.qry_name))
+        return hash(self._key())
 
 
     def _swap(self):
@@ -95,14 +103,19 @@ class NucmerHit:
         self.hit_length_ref, self.hit_length_qry = self.hit_length_qry, self.hit_length_ref
         self.ref_length, self.qry_length = self.qry_length, self.ref_length
         self.ref_name, self.qry_name = self.qry_name, self.ref_name
+        self._qry_coords, self._ref_coords = self._ref_coords, self._qry_coords
 
 
     def qry_coords(self):
-        return pyfastaq.intervals.Interval(min(self.qry_start, self.qry_end), max(self.qry_start, self.qry_end))
+        if self._qry_coords is None:
+            self._qry_coords = pyfastaq.intervals.Interval(min(self.qry_start, self.qry_end), max(self.qry_start, self.qry_end))
+        return self._qry_coords
 
 
     def ref_coords(self):
-        return pyfastaq.intervals.Interval(min(self.ref_start, self.ref_end), max(self.ref_start, self.ref_end))
+        if self._ref_coords is None:
+            self._ref_coords = pyfastaq.intervals.Interval(min(self.ref_start, self.ref_end), max(self.ref_start, self.ref_end))
+        return self._ref_coords
 
 
     def on_same_strand(self):
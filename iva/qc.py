@@ -12,19 +12,206 @@
 # details.
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see <http://www.gnu.org/licenses/>.
+import io
 import os
+import re
+import glob
 import stat
+import operator
+import itertools
 import inspect
 import tempfile
-import copy
 import pyfastaq
+import pysam
 import shutil
 import multiprocessing
 import collections
+import concurrent.futures
 import iva
 
 class Error (Exception): pass
 
+
+# Coverage is turned into strings of one byte per position, and regions
+# are found as runs of bytes with these. See Qc._ref_read_region_coverage
+_low_cov_fwd_regex = re.compile(b'[\x01\x03]+')
+_low_cov_rev_regex = re.compile(b'[\x02\x03]+')
+_low_cov_both_regex = re.compile(b'\x03+')
+_ok_cov_regex = re.compile(b'\x00+')
+
+
+def _merge_overlapping_in_list(l):
+    '''Same as pyfastaq.intervals.merge_overlapping_in_list: sorts the list and
+       merges overlapping and adjacent intervals, in place. But only makes one
+       pass after sorting, instead of popping from the middle of the list'''
+    l.sort(key=lambda x: (x.start, x.end))
+    merged = []
+    for interval in l:
+        if len(merged) and interval.start <= merged[-1].end + 1:
+            if interval.end > merged[-1].end:
+                merged[-1] = pyfastaq.intervals.Interval(merged[-1].start, interval.end)
+        else:
+            merged.append(interval)
+    l[:] = merged
+
+
+def _length_sum_from_list(l):
+    return sum(x.end - x.start + 1 for x in l)
+
+
+def _cat_files(infiles, outfile):
+    with open(outfile, 'wb') as f_out:
+        for filename in infiles:
+            with open(filename, 'rb') as f_in:
+                shutil.copyfileobj(f_in, f_out, 1048576)
+
+
+def _fai_is_stale(fasta, fai):
+    '''Returns True if the fai file is missing or older than the fasta file'''
+    return not os.path.exists(fai) or os.path.getmtime(fai) < os.path.getmtime(fasta)
+
+
+def _faidx_if_stale(fasta):
+    '''Runs samtools faidx on the fasta file, unless its fai file is up to date'''
+    if _fai_is_stale(fasta, fasta + '.fai'):
+        iva.common.syscall('samtools faidx ' + fasta)
+
+
+def _raise_if_any_failed(jobs):
+    '''Raises the exception of any finished job in the dict of
+       name -> concurrent.futures.Future that failed'''
+    for job in jobs.values():
+        if job.done() and not job.cancelled() and job.exception() is not None:
+            job.result()
+
+
+def _stop_jobs(executor, jobs):
+    '''Shuts down the executor without waiting for any of the jobs that
+       are not finished. Those are cancelled, or killed if they are running'''
+    if not all(job.done() for job in jobs.values()):
+        for job in jobs.values():
+            job.cancel()
+        # ProcessPoolExecutor has no public way to stop a running job
+        for process in list(executor._processes.values()):
+            process.terminate()
+    executor.shutdown(wait=False)
+
+
+def _convert_embl(args):
+    embl_file, fa_out, gff_out, embl2gff = args
+    pyfastaq.tasks.to_fasta(embl_file, fa_out)
+    iva.common.syscall(' '.join([embl2gff, embl_file, '>', gff_out]))
+
+
+def _next_fastq_record_start(f, offset):
+    '''Returns the file position of the first FASTQ record that starts at or
+       after offset. Assumes every record is exactly four lines'''
+    f.seek(offset)
+    if offset > 0:
+        f.seek(offset - 1)
+        f.readline()
+    positions = []
+    lines = []
+    while True:
+        positions.append(f.tell())
+        line = f.readline()
+        if line == b'':
+            return positions[-1]
+        lines.append(line)
+        # a line starting with @ could be a header or a quality line, but
+        # only a header is followed two lines later by a line starting with +
+        if len(lines) >= 3 and lines[-3].startswith(b'@') and lines[-1].startswith(b'+'):
+            return positions[-3]
+
+
+def _read_fastq_chunk(infile, start, end):
+    f = open(infile, 'rb')
+    f.seek(start)
+    lines = f.read(end - start).splitlines(keepends=True)
+    f.close()
+    if len(lines) and not lines[-1].endswith(b'\n'):
+        lines[-1] += b'\n'
+    return lines
+
+
+def _count_fastq_chunk_lines(args):
+    '''Returns tuple (number of lines, True iff there is a blank line
+       where a record should start)'''
+    infile, start, end = args
+    lines = _read_fastq_chunk(infile, start, end)
+    return len(lines), any(lines[i].strip() == b'' for i in range(0, len(lines), 4))
+
+
+def _fastq_record_to_bytes(lines):
+    '''Returns the four lines of a FASTQ record, written the same way as
+       pyfastaq does: no trailing whitespace or carriage returns, and a bare +
+       separator line'''
+    for line, start in [(lines[0], b'@'), (lines[2], b'+')]:
+        if not line.startswith(start):
+            raise Error('Error getting next sequence from fastq file. Got line:\n' + line.decode(errors='replace'))
+    return lines[0].rstrip() + b'\n' + lines[1].strip() + b'\n+\n' + lines[3].rstrip() + b'\n'
+
+
+def _deinterleave_fastq_chunk(args):
+    infile, start, end, mate_1_first, out_1, out_2 = args
+    lines = _read_fastq_chunk(infile, start, end)
+    if not mate_1_first:
+        out_1, out_2 = out_2, out_1
+    for outfile, first_line in [(out_1, 0), (out_2, 4)]:
+        f = open(outfile, 'wb')
+        f.write(b''.join([_fastq_record_to_bytes(lines[i:i+4]) for i in range(first_line, len(lines), 8)]))
+        f.close()
+
+
+def _deinterleave(infile, out_1, out_2, threads=1, chunk_size=67108864):
+    '''Deinterleaves a file of reads. Uncompressed FASTQ files with
+       four lines per record are split into chunks that are processed in
+       parallel. Anything else is handled by pyfastaq'''
+    if threads == 1 or infile.endswith('.gz'):
+        pyfastaq.tasks.deinterleave(infile, out_1, out_2)
+        return
+
+    f = open(infile, 'rb')
+    is_fastq = f.read(1) == b'@'
+    if is_fastq:
+        file_size = os.path.getsize(infile)
+        chunks = max(threads, -(-file_size // chunk_size))
+        offsets = [_next_fastq_record_start(f, int(i * file_size / chunks)) for i in range(chunks)]
+        offsets = sorted(set(offsets + [file_size]))
+    f.close()
+
+    if not is_fastq:
+        pyfastaq.tasks.deinterleave(infile, out_1, out_2)
+        return
+
+    with multiprocessing.Pool(threads) as pool:
+        chunk_info = pool.map(_count_fastq_chunk_lines, [(infile, offsets[i], offsets[i+1]) for i in range(len(offsets) - 1)])
+        line_counts = [x[0] for x in chunk_info]
+
+        if sum(x % 4 for x in line_counts) > 0 or any(x[1] for x in chunk_info):
+            # not four lines per record, or blank lines between records that
+            # pyfastaq skips, so leave it to pyfastaq
+            pyfastaq.tasks.deinterleave(infile, out_1, out_2)
+            return
+
+        if sum(line_counts) % 8 != 0:
+            raise Error('Error getting mate for sequence when deinterleaving ' + infile + '. Cannot continue')
+
+        tmpdir = tempfile.mkdtemp(prefix='tmp.deinterleave.', dir=os.path.dirname(os.path.abspath(out_1)))
+        try:
+            jobs = []
+            records_so_far = 0
+            for i in range(len(line_counts)):
+                jobs.append((infile, offsets[i], offsets[i+1], records_so_far % 2 == 0, os.path.join(tmpdir, str(i) + '.1'), os.path.join(tmpdir, str(i) + '.2')))
+                records_so_far += line_counts[i] // 4
+
+            pool.map(_deinterleave_fastq_chunk, jobs)
+            _cat_files([x[4] for x in jobs], out_1)
+            _cat_files([x[5] for x in jobs], out_2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
 class Qc:
     def __init__(self,
         assembly_fasta,
@@ -93,41 +280,45 @@ class Qc:
             self.reads_rev = self.outprefix + '.reads_2'
             self.files_to_clean.append(self.reads_fwd)
             self.files_to_clean.append(self.reads_rev)
-            pyfastaq.tasks.deinterleave(reads_fr, self.reads_fwd, self.reads_rev)
+            _deinterleave(reads_fr, self.reads_fwd, self.reads_rev, threads=self.threads)
 
         if not (None not in [self.reads_fwd, self.reads_rev] or reads_fr is not None):
             raise Error('IVA QC needs reads_fr or both reads_fwd and reads_rev')
 
         self._set_assembly_fasta_data(assembly_fasta)
 
-        def unzip_file(infile, outfile):
-            iva.common.syscall('gunzip -c ' + infile + ' > ' + outfile)
+        def unzip_file(infile, outfile, threads):
+            # pigz can use extra threads for decompression, so use it if we can
+            if shutil.which('pigz') is None:
+                iva.common.syscall('gunzip -c ' + infile + ' > ' + outfile)
+            else:
+                iva.common.syscall('pigz -dc -p ' + str(threads) + ' ' + infile + ' > ' + outfile)
 
-        processes = []
+        to_unzip = []
 
         if self.reads_fwd.endswith('.gz'):
             new_reads_fwd = self.outprefix + '.reads_1'
-            processes.append(multiprocessing.Process(target=unzip_file, args=(self.reads_fwd, new_reads_fwd)))
+            to_unzip.append((self.reads_fwd, new_reads_fwd))
             self.reads_fwd = new_reads_fwd
             self.files_to_clean.append(self.reads_fwd)
 
         if self.reads_rev.endswith('.gz'):
             new_reads_rev = self.outprefix + '.reads_2'
-            processes.append(multiprocessing.Process(target=unzip_file, args=(self.reads_rev, new_reads_rev)))
+            to_unzip.append((self.reads_rev, new_reads_rev))
             self.reads_rev = new_reads_rev
             self.files_to_clean.append(self.reads_rev)
 
-        if len(processes) == 1:
-            processes[0].start()
-            processes[0].join()
-        elif len(processes) == 2:
-            processes[0].start()
-            if self.threads == 1:
-                processes[0].join()
-            processes[1].start()
-            processes[1].join()
-            if self.threads > 1:
-                processes[0].join()
+        if len(to_unzip):
+            # share the threads between the files, and only unzip them at the
+            # same time if we have more than one thread
+            unzip_threads = max(1, self.threads // len(to_unzip))
+            processes = [multiprocessing.Process(target=unzip_file, args=(infile, outfile, unzip_threads)) for infile, outfile in to_unzip]
+            for p in processes:
+                p.start()
+                if self.threads == 1:
+                    p.join()
+            for p in processes:
+                p.join()
 
         self.min_ref_cov = min_ref_cov
         self.threads = threads
@@ -183,16 +374,15 @@ class Qc:
     def _set_assembly_fasta_data(self, fasta_filename):
         self.assembly_is_empty = os.path.getsize(fasta_filename) == 0
         if self.assembly_is_empty:
+            self.assembly_lengths = {}
             return
 
         pyfastaq.tasks.to_fasta(fasta_filename, self.assembly_fasta, strip_after_first_whitespace=True)
 
         self.assembly_fasta_fai = self.assembly_fasta + '.fai'
-        if not os.path.exists(self.assembly_fasta_fai):
-            iva.common.syscall('samtools faidx ' + self.assembly_fasta)
+        _faidx_if_stale(self.assembly_fasta)
 
-        self.assembly_lengths = {}
-        pyfastaq.tasks.lengths_from_fai(self.assembly_fasta_fai, self.assembly_lengths)
+        self.assembly_lengths = self._lengths_from_fai(self.assembly_fasta_fai)
 
 
     def _set_ref_seq_data(self):
@@ -207,43 +397,42 @@ class Qc:
         extractor.copy_file(embl2gff_egg, embl2gff)
         os.chmod(embl2gff, stat.S_IRWXU)
 
-        for embl_file in os.listdir(self.embl_dir):
-            fa = os.path.join(tmpdir, embl_file + '.fa')
-            gff = os.path.join(tmpdir, embl_file + '.gff')
-            embl_full = os.path.join(self.embl_dir, embl_file)
-            pyfastaq.tasks.to_fasta(embl_full, fa)
-            iva.common.syscall(' '.join([embl2gff, embl_full, '>', gff]))
+        to_convert = [(os.path.join(self.embl_dir, x), os.path.join(tmpdir, x + '.fa'), os.path.join(tmpdir, x + '.gff'), embl2gff) for x in os.listdir(self.embl_dir)]
+        if self.threads > 1 and len(to_convert) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.threads, len(to_convert))) as executor:
+                list(executor.map(_convert_embl, to_convert))
+        else:
+            for x in to_convert:
+                _convert_embl(x)
 
-        iva.common.syscall('cat ' + tmpdir + '/*.gff > ' + self.ref_gff)
-        iva.common.syscall('cat ' + tmpdir + '/*.fa > ' + self.ref_fasta)
+        _cat_files(sorted(glob.glob(os.path.join(tmpdir, '*.gff'))), self.ref_gff)
+        _cat_files(sorted(glob.glob(os.path.join(tmpdir, '*.fa'))), self.ref_fasta)
         shutil.rmtree(tmpdir)
         self._set_ref_fa_data()
 
 
     def _set_ref_fa_data(self):
         self.ref_fasta_fai = self.ref_fasta + '.fai'
-        iva.common.syscall('samtools faidx ' + self.ref_fasta)
-        self.ref_ids = self._ids_in_order_from_fai(self.ref_fasta_fai)
-        self.ref_lengths = {}
-        pyfastaq.tasks.lengths_from_fai(self.ref_fasta_fai, self.ref_lengths)
+        _faidx_if_stale(self.ref_fasta)
+        self.ref_ids, self.ref_lengths = self._ids_and_lengths_from_fai(self.ref_fasta_fai)
         number_of_sequences = pyfastaq.tasks.count_sequences(self.ref_fasta)
         if number_of_sequences != len(self.ref_lengths):
             raise Error('At least one reference name has been used more than once.\nNames must be unique. Cannot continue')
 
-        self.ref_length_offsets = {}
-        offset = 0
-        for seq in self.ref_ids:
-            self.ref_length_offsets[seq] = offset
-            offset += self.ref_lengths[seq]
+        offsets = itertools.accumulate(itertools.chain([0], (self.ref_lengths[x] for x in self.ref_ids)))
+        self.ref_length_offsets = dict(zip(self.ref_ids, offsets))
 
 
-    def _ids_in_order_from_fai(self, filename):
-        ids = []
-        f = pyfastaq.utils.open_file_read(filename)
-        for line in f:
-            ids.append(line.rstrip().split('\t')[0])
-        pyfastaq.utils.close(f)
-        return ids
+    def _ids_and_lengths_from_fai(self, filename):
+        '''Returns tuple: (list of ids in file order, dict of id -> length)'''
+        # fai files are always plain text made by samtools faidx
+        with open(filename) as f:
+            fields = [line.split('\t', 2) for line in f.read().splitlines()]
+        return [x[0] for x in fields], {x[0]: int(x[1]) for x in fields}
+
+
+    def _lengths_from_fai(self, filename):
+        return self._ids_and_lengths_from_fai(filename)[1]
 
 
     def _get_ref_cds_from_gff(self):
@@ -265,11 +454,12 @@ class Qc:
                 strand = data[6]
                 if seqname not in coords:
                     coords[seqname] = []
-                coords[seqname].append((pyfastaq.intervals.Interval(start, end), strand))
+                coords[seqname].append((start, end, strand))
 
         pyfastaq.utils.close(f)
-        for seqname in coords:
-            coords[seqname].sort()
+        for seqname, cds_list in coords.items():
+            cds_list.sort()
+            coords[seqname] = [(pyfastaq.intervals.Interval(start, end), strand) for start, end, strand in cds_list]
 
         return coords
 
@@ -312,16 +502,21 @@ class Qc:
     def _mummer_coords_file_to_dict(self, filename):
         hits = {}
         for hit in iva.mummer.file_reader(filename):
-            if hit.qry_name not in hits:
-                hits[hit.qry_name] = []
-            hits[hit.qry_name].append(copy.copy(hit))
+            hits.setdefault(hit.qry_name, []).append(hit)
         return hits
 
 
-    def _has_orf(self, fa, start, end, min_length):
-        subseq = pyfastaq.sequences.Fasta('seq', fa[start:end+1])
-        orfs = subseq.all_orfs(min_length=min_length)
-        return len(orfs) > 0
+    def _has_orf(self, seq, min_length):
+        # Only need to know if there is one long enough ORF, so stop at the
+        # first one found instead of getting all of them
+        subseq = pyfastaq.sequences.Fasta('seq', seq)
+        subseq_revcomp = pyfastaq.sequences.Fasta('seq', seq)
+        subseq_revcomp.revcomp()
+        for fa in subseq, subseq_revcomp:
+            for frame in range(3):
+                if any(len(orf) >= min_length for orf in fa.orfs(frame=frame)):
+                    return True
+        return False
 
 
     def _calculate_cds_assembly_stats(self):
@@ -329,24 +524,26 @@ class Qc:
             return
         self._map_cds_to_assembly()
         hits = self._mummer_coords_file_to_dict(self.cds_nucmer_coords_in_assembly)
-        contigs = {}
-        pyfastaq.tasks.file_to_dict(self.assembly_fasta, contigs)
+        contigs = pysam.FastaFile(self.assembly_fasta)
         for cds_name, hit_list in hits.items():
             self.cds_assembly_stats[cds_name]['number_of_contig_hits'] = len(hit_list)
             hit_coords = [x.qry_coords() for x in hit_list]
-            pyfastaq.intervals.merge_overlapping_in_list(hit_coords)
-            bases_assembled = pyfastaq.intervals.length_sum_from_list(hit_coords)
+            _merge_overlapping_in_list(hit_coords)
+            bases_assembled = _length_sum_from_list(hit_coords)
             self.cds_assembly_stats[cds_name]['bases_assembled'] = bases_assembled
             self.cds_assembly_stats[cds_name]['assembled'] = 0.9 <= bases_assembled / self.cds_assembly_stats[cds_name]['length_in_ref'] <= 1.1
 
             if len(hit_list) == 1:
                 hit = hit_list[0]
                 contig_coords = hit.ref_coords()
-                has_orf = self._has_orf(contigs[hit.ref_name], contig_coords.start, contig_coords.end, 0.9 * self.cds_assembly_stats[cds_name]['length_in_ref'])
+                subseq = contigs.fetch(hit.ref_name, contig_coords.start, contig_coords.end + 1)
+                has_orf = self._has_orf(subseq, 0.9 * self.cds_assembly_stats[cds_name]['length_in_ref'])
                 self.cds_assembly_stats[cds_name]['assembled_ok'] = has_orf
             else:
                 self.cds_assembly_stats[cds_name]['assembled_ok'] = False
 
+        contigs.close()
+
 
     def _get_contig_hits_to_reference(self):
         iva.mummer.run_nucmer(self.assembly_fasta, self.ref_fasta, self.assembly_vs_ref_coords, min_id=self.nucmer_min_ctg_hit_id, min_length=self.nucmer_min_ctg_hit_length, breaklen=500)
@@ -354,12 +551,12 @@ class Qc:
 
 
     def _write_fasta_contigs_hit_ref(self):
-        contigs = {}
-        pyfastaq.tasks.file_to_dict(self.assembly_fasta, contigs)
+        contigs = pysam.FastaFile(self.assembly_fasta)
         f = pyfastaq.utils.open_file_write(self.fasta_assembly_contigs_hit_ref)
         for qry_name in sorted(self.assembly_vs_ref_mummer_hits):
-            print(contigs[qry_name], file=f)
+            print(pyfastaq.sequences.Fasta(qry_name, contigs.fetch(qry_name)), file=f)
         pyfastaq.utils.close(f)
+        contigs.close()
 
 
     def _write_fasta_contigs_not_hit_ref(self):
@@ -375,9 +572,7 @@ class Qc:
         d = {}
         for l in hits.values():
             for hit in l:
-                if hit.ref_name not in d:
-                    d[hit.ref_name] = []
-                d[hit.ref_name].append(copy.copy(hit))
+                d.setdefault(hit.ref_name, []).append(hit)
         return d
 
 
@@ -392,11 +587,12 @@ class Qc:
             if name in refhits:
                 hits = refhits[name]
                 coords = [hit.ref_coords() for hit in hits]
-                pyfastaq.intervals.merge_overlapping_in_list(coords)
+                _merge_overlapping_in_list(coords)
+                bases_assembled = _length_sum_from_list(coords)
                 self.refseq_assembly_stats[name] = {
                     'hits': len(hits),
-                    'bases_assembled': pyfastaq.intervals.length_sum_from_list(coords),
-                    'assembled': 0.9 <= pyfastaq.intervals.length_sum_from_list(coords) / self.ref_lengths[name],
+                    'bases_assembled': bases_assembled,
+                    'assembled': 0.9 <= bases_assembled / self.ref_lengths[name],
                     'assembled_ok': len(hits) == 1 and 0.9 <= hits[0].hit_length_ref / self.ref_lengths[name] <= 1.1 and 0.9 <= hits[0].qry_length / hits[0].hit_length_qry,
                     'longest_matching_contig': self._longest_matching_contig(refhits, name),
                 }
@@ -412,72 +608,46 @@ class Qc:
 
 
     def _invert_list(self, coords, seq_length):
-        if len(coords) == 0:
-            return[pyfastaq.intervals.Interval(0, seq_length - 1)]
-
-        not_covered = []
-
-        if coords[0].start != 0:
-            not_covered.append(pyfastaq.intervals.Interval(0, coords[0].start - 1))
-
-        for i in range(len(coords) - 1):
-            not_covered.append(pyfastaq.intervals.Interval(coords[i].end + 1, coords[i+1].start - 1))
-
-        if coords[-1].end < seq_length - 1:
-            not_covered.append(pyfastaq.intervals.Interval(coords[-1].end + 1, seq_length - 1))
-
-        return not_covered
+        # gap i is between the end of interval i-1 and the start of interval i
+        gap_starts = [0] + [x.end + 1 for x in coords]
+        gap_ends = [x.start - 1 for x in coords] + [seq_length - 1]
+        return [pyfastaq.intervals.Interval(start, end) for start, end in zip(gap_starts, gap_ends) if start <= end]
 
 
     def _calculate_ref_positions_covered_by_contigs(self):
         if self.assembly_is_empty:
-            self.ref_pos_not_covered_by_contigs = {}
-            for seq, lngth in self.ref_lengths.items():
-                self.ref_pos_not_covered_by_contigs[seq] = [pyfastaq.intervals.Interval(0, lngth - 1)]
+            self.ref_pos_not_covered_by_contigs = {seq: [pyfastaq.intervals.Interval(0, lngth - 1)] for seq, lngth in self.ref_lengths.items()}
             return
 
         for seq in self.assembly_vs_ref_mummer_hits:
             for hit in self.assembly_vs_ref_mummer_hits[seq]:
-                if hit.ref_name not in self.ref_pos_covered_by_contigs:
-                    self.ref_pos_covered_by_contigs[hit.ref_name] = []
-                self.ref_pos_covered_by_contigs[hit.ref_name].append(hit.ref_coords())
+                self.ref_pos_covered_by_contigs.setdefault(hit.ref_name, []).append(hit.ref_coords())
 
         for coords_list in self.ref_pos_covered_by_contigs.values():
-            pyfastaq.intervals.merge_overlapping_in_list(coords_list)
-
-        for seq in self.ref_ids:
-            if seq in self.ref_pos_covered_by_contigs:
-                l = self.ref_pos_covered_by_contigs[seq]
-            else:
-                l = []
-            self.ref_pos_not_covered_by_contigs[seq] = self._invert_list(l, self.ref_lengths[seq])
+            _merge_overlapping_in_list(coords_list)
 
-
-    def _get_overlapping_qry_hits(self, hits, hit):
-        overlapping = []
-        hit_coords = hit.qry_coords()
-
-        for test_hit in hits:
-            if test_hit != hit:
-                test_coords = test_hit.qry_coords()
-                if test_coords.intersects(hit_coords):
-                    overlapping.append(test_hit)
-
-        return overlapping
+        self.ref_pos_not_covered_by_contigs = {seq: self._invert_list(self.ref_pos_covered_by_contigs.get(seq, []), self.ref_lengths[seq]) for seq in self.ref_ids}
 
 
     def _get_unique_and_repetitive_from_contig_hits(self, hits):
-        unique = []
-        repetitive = []
-        if len(hits) == 0:
-            return unique, repetitive
-
-        for hit in hits:
-            if len(self._get_overlapping_qry_hits(hits, hit)):
-                repetitive.append(hit)
-            else:
-                unique.append(hit)
-
+        # Sweep along the contig in order of hit start position, keeping
+        # the hit that reaches furthest so far. A hit overlaps an earlier
+        # hit iff it starts before that furthest end, and then those two
+        # hits are both repetitive. O(n log n) instead of testing all pairs.
+        repetitive_mask = [False] * len(hits)
+        furthest_end = None
+        furthest_index = None
+
+        for start, end, i in sorted((coords.start, coords.end, i) for i, coords in enumerate(x.qry_coords() for x in hits)):
+            if furthest_end is not None and start <= furthest_end:
+                repetitive_mask[i] = True
+                repetitive_mask[furthest_index] = True
+            if furthest_end is None or end > furthest_end:
+                furthest_end = end
+                furthest_index = i
+
+        unique = [hits[i] for i in range(len(hits)) if not repetitive_mask[i]]
+        repetitive = [hits[i] for i in range(len(hits)) if repetitive_mask[i]]
         return unique, repetitive
 
 
@@ -502,7 +672,7 @@ class Qc:
         unique_hits, repetitive_hits = self._get_unique_and_repetitive_from_contig_hits(hits)
         placement = [(x.qry_coords(), x.ref_name, x.ref_coords(), x.on_same_strand(), False) for x in unique_hits]
         placement += [(x.qry_coords(), x.ref_name, x.ref_coords(), x.on_same_strand(), True) for x in repetitive_hits]
-        placement.sort()
+        placement.sort(key=lambda x: (x[0].start, x[0].end, x[1], x[2].start, x[2].end, x[3], x[4]))
         return placement
 
 
@@ -514,21 +684,15 @@ class Qc:
 
 
     def _get_R_plot_contig_order_from_contig_placement(self):
+        # Sort by position in the reference, then by the rest of the placement info
         contig_positions = []
         for qryname, coords_list in  self.contig_placement.items():
             for qry_coords, refname, ref_coords, same_strand, repetitive in coords_list:
                 offset = self.ref_length_offsets[refname]
-                ref_coords = pyfastaq.intervals.Interval(ref_coords.start + offset, ref_coords.end + offset)
-                contig_positions.append((ref_coords, qry_coords, same_strand, repetitive, qryname))
+                contig_positions.append((ref_coords.start + offset, ref_coords.end + offset, qry_coords.start, qry_coords.end, same_strand, repetitive, qryname))
 
         contig_positions.sort()
-        names = set()
-        contig_names = []
-        for name in [x[4] for x in contig_positions]:
-            if name not in names:
-                contig_names.append(name)
-                names.add(name)
-        return contig_names
+        return list(collections.OrderedDict.fromkeys(x[-1] for x in contig_positions))
 
 
     def _map_reads_to_assembly(self):
@@ -570,52 +734,62 @@ class Qc:
         iva.qc_external.run_blastn_and_write_act_script(self.assembly_fasta, self.ref_fasta, self.blast_out, self.act_script)
 
 
-    def _map_reads_to_reference(self):
+    def _map_reads_to_reference(self, threads=None):
         assert os.path.exists(self.ref_fasta)
-        iva.mapping.map_reads(self.reads_fwd, self.reads_rev, self.ref_fasta, self.ref_bam[:-4], sort=True, threads=self.threads, index_k=self.smalt_k, index_s=self.smalt_s, minid=self.smalt_id, extra_smalt_map_ops='-x')
+        if threads is None:
+            threads = self.threads
+        iva.mapping.map_reads(self.reads_fwd, self.reads_rev, self.ref_fasta, self.ref_bam[:-4], sort=True, threads=threads, index_k=self.smalt_k, index_s=self.smalt_s, minid=self.smalt_id, extra_smalt_map_ops='-x')
         os.unlink(self.ref_bam[:-4] + '.unsorted.bam')
 
 
     def _calculate_ref_read_coverage(self):
         if not os.path.exists(self.ref_bam):
             self._map_reads_to_reference()
+        if self.threads > 1:
+            # Each strand is a separate samtools process, so run them at the same time
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                fwd_job = executor.submit(iva.mapping.get_bam_coverage, self.ref_bam, self.ref_lengths)
+                rev_job = executor.submit(iva.mapping.get_bam_coverage, self.ref_bam, self.ref_lengths, rev=True)
+                coverage_fwd = fwd_job.result()
+                coverage_rev = rev_job.result()
+        else:
+            coverage_fwd = iva.mapping.get_bam_coverage(self.ref_bam, self.ref_lengths)
+            coverage_rev = iva.mapping.get_bam_coverage(self.ref_bam, self.ref_lengths, rev=True)
         for seq in self.ref_ids:
             assert seq not in self.ref_coverage_fwd
-            self.ref_coverage_fwd[seq] = iva.mapping.get_bam_region_coverage(self.ref_bam, seq, self.ref_lengths[seq])
+            self.ref_coverage_fwd[seq] = coverage_fwd[seq]
             assert seq not in self.ref_coverage_rev
-            self.ref_coverage_rev[seq] = iva.mapping.get_bam_region_coverage(self.ref_bam, seq, self.ref_lengths[seq], rev=True)
+            self.ref_coverage_rev[seq] = coverage_rev[seq]
 
 
-    def _coverage_list_to_low_cov_intervals(self, l):
-        bad_intervals = []
-        start = None
-        cov_bad = False
+    def _byte_runs_to_intervals(self, regex, s):
+        return [pyfastaq.intervals.Interval(m.start(), m.end() - 1) for m in regex.finditer(s)]
 
-        for i in range(len(l)):
-            cov_bad = l[i] < self.min_ref_cov
-            if cov_bad:
-                if start is None:
-                    start = i
-            else:
-                if start is not None:
-                    bad_intervals.append(pyfastaq.intervals.Interval(start, i-1))
-                start = None
 
-        if cov_bad and start is not None:
-            bad_intervals.append(pyfastaq.intervals.Interval(start, i))
-        return bad_intervals
+    def _ref_read_region_coverage(self, seq):
+        '''Returns tuple of lists of intervals for one reference sequence:
+           (low cov fwd, low cov rev, ok cov, low cov on both strands)'''
+        # Encode both strands in one byte per position: 0 = OK coverage
+        # on both strands, 1 = low on fwd only, 2 = low on rev only,
+        # 3 = low on both. Then each set of regions is a regex search
+        # over the same string, instead of separate passes that make
+        # intermediate lists of intervals
+        fwd_low = map(operator.lt, self.ref_coverage_fwd[seq], itertools.repeat(self.min_ref_cov))
+        rev_low = map(operator.lt, self.ref_coverage_rev[seq], itertools.repeat(self.min_ref_cov))
+        low_cov = bytes(map(operator.add, fwd_low, map(operator.mul, rev_low, itertools.repeat(2))))
+        return (
+            self._byte_runs_to_intervals(_low_cov_fwd_regex, low_cov),
+            self._byte_runs_to_intervals(_low_cov_rev_regex, low_cov),
+            self._byte_runs_to_intervals(_ok_cov_regex, low_cov),
+            self._byte_runs_to_intervals(_low_cov_both_regex, low_cov),
+        )
 
 
     def _calculate_ref_read_region_coverage(self):
         assert len(self.ref_coverage_fwd)
         assert len(self.ref_coverage_rev)
         for seq in self.ref_ids:
-            self.low_cov_ref_regions_fwd[seq] = self._coverage_list_to_low_cov_intervals(self.ref_coverage_fwd[seq])
-            self.low_cov_ref_regions_rev[seq] = self._coverage_list_to_low_cov_intervals(self.ref_coverage_rev[seq])
-            fwd_ok = self._invert_list(self.low_cov_ref_regions_fwd[seq], self.ref_lengths[seq])
-            rev_ok = self._invert_list(self.low_cov_ref_regions_rev[seq], self.ref_lengths[seq])
-            self.ok_cov_ref_regions[seq] = pyfastaq.intervals.intersection(fwd_ok, rev_ok)
-            self.low_cov_ref_regions[seq] = pyfastaq.intervals.intersection(self.low_cov_ref_regions_fwd[seq], self.low_cov_ref_regions_rev[seq])
+            self.low_cov_ref_regions_fwd[seq], self.low_cov_ref_regions_rev[seq], self.ok_cov_ref_regions[seq], self.low_cov_ref_regions[seq] = self._ref_read_region_coverage(seq)
 
 
     def _write_ref_coverage_to_files_for_R(self, outprefix):
@@ -624,24 +798,25 @@ class Qc:
         def list_to_file(d, fname):
             f = pyfastaq.utils.open_file_write(fname)
             for refname in self.ref_ids:
-                for x in d[refname]:
-                    print(x, file=f)
+                f.writelines(map('{}\n'.format, d[refname]))
             pyfastaq.utils.close(f)
         list_to_file(self.ref_coverage_fwd, outprefix + '.fwd')
         list_to_file(self.ref_coverage_rev, outprefix + '.rev')
 
 
     def _cov_to_R_string(self, intervals, colour, x_offset, y_position, contig_height):
-        s = ''
+        y_bottom = y_position - 0.5 * contig_height
+        y_top = y_position + 0.5 * contig_height
+        lines = []
         for interval in intervals:
-            s += 'rect(' + \
-                 str(interval.start + x_offset) + ', ' + \
-                 str(y_position - 0.5 * contig_height) + ', ' + \
-                 str(interval.end + x_offset) + ', ' + \
-                 str(y_position + 0.5 * contig_height) + ', ' + \
-                 'col="' + colour + '", ' + \
-                 'border=NA)\n'
-        return s
+            lines.append('rect({}, {}, {}, {}, col="{}", border=NA)\n'.format(
+                interval.start + x_offset,
+                y_bottom,
+                interval.end + x_offset,
+                y_top,
+                colour
+            ))
+        return ''.join(lines)
 
 
     def _calculate_should_have_assembled(self):
@@ -653,17 +828,32 @@ class Qc:
             self.should_have_assembled[name] = pyfastaq.intervals.intersection(self._invert_list(l, self.ref_lengths[name]), self.ok_cov_ref_regions[name])
 
 
-    def _calculate_gage_stats(self):
+    def _start_gage_and_ratt(self, executor):
+        '''GAGE and RATT only need the assembly and reference files, and they
+        each run in their own directory. So start them in the given
+        executor, to run while everything else is calculated. Returns a dict
+        of name -> concurrent.futures.Future'''
+        return {
+            'gage': executor.submit(iva.qc_external.run_gage, self.ref_fasta, self.assembly_fasta, self.gage_outdir, nucmer_minid=self.gage_nucmer_minid, clean=self.clean),
+            'ratt': executor.submit(iva.qc_external.run_ratt, self.embl_dir, self.assembly_fasta, self.ratt_outdir, config_file=self.ratt_config, clean=self.clean),
+        }
+
+
+    def _calculate_gage_stats(self, job=None):
         if self.assembly_is_empty:
             self.gage_stats = iva.qc_external.dummy_gage_stats()
             self.gage_stats['Missing Reference Bases'] = sum(self.ref_lengths.values())
+        elif job is not None:
+            self.gage_stats = job.result()
         else:
             self.gage_stats = iva.qc_external.run_gage(self.ref_fasta, self.assembly_fasta, self.gage_outdir, nucmer_minid=self.gage_nucmer_minid, clean=self.clean)
 
 
-    def _calculate_ratt_stats(self):
+    def _calculate_ratt_stats(self, job=None):
         if self.assembly_is_empty:
             self.ratt_stats = iva.qc_external.dummy_ratt_stats()
+        elif job is not None:
+            self.ratt_stats = job.result()
         else:
             self.ratt_stats = iva.qc_external.run_ratt(self.embl_dir, self.assembly_fasta, self.ratt_outdir, config_file=self.ratt_config, clean=self.clean)
 
@@ -672,20 +862,38 @@ class Qc:
         self._map_reads_to_assembly()
         self._choose_reference_genome()
         self._set_ref_seq_data()
-        self._make_act_files()
-        self._map_reads_to_reference()
-        self._calculate_incorrect_assembly_bases()
-        self._calculate_contig_placement()
-        self._write_fasta_contigs_hit_ref()
-        self._write_fasta_contigs_not_hit_ref()
-        self._calculate_ref_read_coverage()
-        self._calculate_ref_read_region_coverage()
-        self._calculate_ref_positions_covered_by_contigs()
-        self._calculate_should_have_assembled()
-        self._calculate_cds_assembly_stats()
-        self._calculate_refseq_assembly_stats()
-        self._calculate_gage_stats()
-        self._calculate_ratt_stats()
+
+        # GAGE and RATT are single-threaded. Run them in the background using
+        # up to two threads, but always keep one thread for everything else
+        external_threads = 0 if self.assembly_is_empty else min(2, self.threads - 1)
+        executor = None
+        external_jobs = {}
+        if external_threads > 0:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=external_threads)
+            external_jobs = self._start_gage_and_ratt(executor)
+
+        try:
+            if not self.assembly_is_empty:
+                self._make_act_files()
+                self._calculate_contig_placement()
+                self._write_fasta_contigs_hit_ref()
+                self._write_fasta_contigs_not_hit_ref()
+                self._calculate_cds_assembly_stats()
+            _raise_if_any_failed(external_jobs)
+            self._map_reads_to_reference(threads=self.threads - external_threads)
+            _raise_if_any_failed(external_jobs)
+            self._calculate_incorrect_assembly_bases()
+            self._calculate_ref_read_coverage()
+            self._calculate_ref_read_region_coverage()
+            self._calculate_ref_positions_covered_by_contigs()
+            self._calculate_should_have_assembled()
+            self._calculate_refseq_assembly_stats()
+            self._calculate_gage_stats(job=external_jobs.get('gage'))
+            self._calculate_ratt_stats(job=external_jobs.get('ratt'))
+        finally:
+            if executor is not None:
+                _stop_jobs(executor, external_jobs)
+
         self._calculate_stats()
 
 
@@ -693,8 +901,8 @@ class Qc:
         total_bases = 0
         for name in self.assembly_vs_ref_mummer_hits:
             coords = [x.qry_coords() for x in self.assembly_vs_ref_mummer_hits[name]]
-            pyfastaq.intervals.merge_overlapping_in_list(coords)
-            total_bases += pyfastaq.intervals.length_sum_from_list(coords)
+            _merge_overlapping_in_list(coords)
+            total_bases += _length_sum_from_list(coords)
         return total_bases, len(self.assembly_vs_ref_mummer_hits)
 
 
@@ -703,18 +911,18 @@ class Qc:
         self.stats['ref_EMBL_files'] = ' '.join(self.embl_files)
         self.stats['ref_bases'] = sum(self.ref_lengths.values())
         self.stats['ref_sequences'] = len(self.ref_lengths)
-        self.stats['ref_bases_assembled'] = sum([pyfastaq.intervals.length_sum_from_list(l) for l in list(self.ref_pos_covered_by_contigs.values())])
-        self.stats['ref_sequences_assembled'] = len([1 for x in self.refseq_assembly_stats.values() if x['assembled']])
-        self.stats['ref_sequences_assembled_ok'] = len([1 for x in self.refseq_assembly_stats.values() if x['assembled_ok']])
-        self.stats['ref_bases_assembler_missed'] = sum([pyfastaq.intervals.length_sum_from_list(l) for l in list(self.should_have_assembled.values())])
+        self.stats['ref_bases_assembled'] = sum(_length_sum_from_list(l) for l in self.ref_pos_covered_by_contigs.values())
+        self.stats['ref_sequences_assembled'] = sum(x['assembled'] for x in self.refseq_assembly_stats.values())
+        self.stats['ref_sequences_assembled_ok'] = sum(x['assembled_ok'] for x in self.refseq_assembly_stats.values())
+        self.stats['ref_bases_assembler_missed'] = sum(_length_sum_from_list(l) for l in self.should_have_assembled.values())
         self.stats['assembly_bases'] = sum(self.assembly_lengths.values())
         self.stats['assembly_contigs'] = len(self.assembly_lengths)
         self.stats['assembly_bases_in_ref'], self.stats['assembly_contigs_hit_ref'] = self._contigs_and_bases_that_hit_ref()
-        self.stats['assembly_bases_reads_disagree'] = sum([len(x) for x in self.incorrect_assembly_bases.values()])
-        self.stats['assembly_sum_longest_match_each_segment'] = sum([x['longest_matching_contig'] for x in self.refseq_assembly_stats.values()])
+        self.stats['assembly_bases_reads_disagree'] = sum(len(x) for x in self.incorrect_assembly_bases.values())
+        self.stats['assembly_sum_longest_match_each_segment'] = sum(x['longest_matching_contig'] for x in self.refseq_assembly_stats.values())
         self.stats['cds_number'] = len(self.cds_assembly_stats)
-        self.stats['cds_assembled'] = len([1 for x in self.cds_assembly_stats.values() if x['assembled']])
-        self.stats['cds_assembled_ok'] = len([1 for x in self.cds_assembly_stats.values() if x['assembled_ok']])
+        self.stats['cds_assembled'] = sum(x['assembled'] for x in self.cds_assembly_stats.values())
+        self.stats['cds_assembled_ok'] = sum(x['assembled_ok'] for x in self.cds_assembly_stats.values())
 
 
     def _write_stats_txt(self):
@@ -752,7 +960,7 @@ class Qc:
         number_of_contigs = len(contig_names)
         ref_length = sum(self.ref_lengths.values())
         r_script = outprefix + '.R'
-        f = pyfastaq.utils.open_file_write(r_script)
+        f = io.StringIO()
         contig_height = 0.8
         vertical_lines = ''
         if len(self.ref_ids) > 0:
@@ -762,24 +970,24 @@ class Qc:
                     vertical_lines += '\n' + 'abline(v=' + str(x_position) + ', col="gray")'
 
 
-        print('pdf(file="', outprefix, '.pdf")', sep='', file=f)
-        print('layout(matrix(c(1,2,3), 3, 1, byrow = TRUE), heights=c(3,1.2,1.2))', file=f)
-        print('par(mar=c(1, 4, 2, 0.5))', file=f)
+        f.write('pdf(file="{}.pdf")\n'.format(outprefix))
+        f.write('layout(matrix(c(1,2,3), 3, 1, byrow = TRUE), heights=c(3,1.2,1.2))\n')
+        f.write('par(mar=c(1, 4, 2, 0.5))\n')
 
         # ---------- contig layout plot ------------------------
-        print('plot(-100, type="n", xlim=c(0,', ref_length, '), ylim=c(0, ', number_of_contigs, '), yaxt="n", ylab="", xlab="")', sep='', file=f)
-        print('title("', self.contig_layout_plot_title, '", ylab="Contigs")', sep='', file=f)
-        print(vertical_lines, file=f)
+        f.write('plot(-100, type="n", xlim=c(0,{}), ylim=c(0, {}), yaxt="n", ylab="", xlab="")\n'.format(ref_length, number_of_contigs))
+        f.write('title("{}", ylab="Contigs")\n'.format(self.contig_layout_plot_title))
+        f.write(vertical_lines + '\n')
 
         if number_of_contigs > 0:
-            print('contig_names=c("', '", "'.join(contig_names), '")', sep='', file=f)
-            print('axis(2, at=c(1:', number_of_contigs, '), labels=contig_names, las=2, cex.axis=0.3)', sep='', file=f)
+            f.write('contig_names=c("{}")\n'.format('", "'.join(contig_names)))
+            f.write('axis(2, at=c(1:{}), labels=contig_names, las=2, cex.axis=0.3)\n'.format(number_of_contigs))
 
-            for i in range(len(contig_names)):
-                contig_name = contig_names[i]
+            for i, contig_name in enumerate(contig_names):
                 y_centre = i + 1
-                contig_positions = self.contig_placement[contig_name]
-                for contig_coords, ref_name, ref_coords, same_strand, repetitive in contig_positions:
+                y_bottom = y_centre - 0.5 * contig_height
+                y_top = y_centre + 0.5 * contig_height
+                for contig_coords, ref_name, ref_coords, same_strand, repetitive in self.contig_placement[contig_name]:
                     offset = self.ref_length_offsets[ref_name]
                     if repetitive:
                         colour = "red"
@@ -789,44 +997,42 @@ class Qc:
                     if same_strand:
                          colour = "dark" + colour
 
-                    print('rect(', ref_coords.start + offset, ',',
-                            y_centre - 0.5 * contig_height, ',',
-                            ref_coords.end + offset, ',',
-                            y_centre + 0.5 * contig_height, ',',
-                            'col="', colour, '")', sep='', file=f)
+                    f.write('rect({},{},{},{},col="{}")\n'.format(ref_coords.start + offset, y_bottom, ref_coords.end + offset, y_top, colour))
 
         # ----------- read coverage heatmap ---------------------
-        print('par(mar=c(0, 4, 1, 0.5))', file=f)
-        print('plot(-100, type="n", xlim=c(0,', ref_length, '), ylim=c(0, ', 3, '), xaxt="n", yaxt="n", ylab="Contig/Read coverage OK", xlab="", frame.plot=F)', sep='', file=f)
-        print('axis(2, at=c(1,2), labels=c("Reads", "Contigs"), las=2, cex.axis=0.6)', sep='', file=f)
+        f.write('par(mar=c(0, 4, 1, 0.5))\n')
+        f.write('plot(-100, type="n", xlim=c(0,{}), ylim=c(0, 3), xaxt="n", yaxt="n", ylab="Contig/Read coverage OK", xlab="", frame.plot=F)\n'.format(ref_length))
+        f.write('axis(2, at=c(1,2), labels=c("Reads", "Contigs"), las=2, cex.axis=0.6)\n')
 
         for name in self.ref_ids:
             offset = self.ref_length_offsets[name]
-            print(self._cov_to_R_string(self.ok_cov_ref_regions[name], 'black', offset, 1.3, 0.25), file=f)
-            print(self._cov_to_R_string(self.low_cov_ref_regions_fwd[name], 'red', offset, 1, 0.25), file=f)
-            print(self._cov_to_R_string(self.low_cov_ref_regions_rev[name], 'red', offset, 0.7, 0.25), file=f)
+            f.write(self._cov_to_R_string(self.ok_cov_ref_regions[name], 'black', offset, 1.3, 0.25) + '\n')
+            f.write(self._cov_to_R_string(self.low_cov_ref_regions_fwd[name], 'red', offset, 1, 0.25) + '\n')
+            f.write(self._cov_to_R_string(self.low_cov_ref_regions_rev[name], 'red', offset, 0.7, 0.25) + '\n')
 
             if name in self.ref_pos_covered_by_contigs:
-                print(self._cov_to_R_string(self.ref_pos_covered_by_contigs[name], 'black', offset, 2.3, 0.25), file=f)
+                f.write(self._cov_to_R_string(self.ref_pos_covered_by_contigs[name], 'black', offset, 2.3, 0.25) + '\n')
 
             if name in self.should_have_assembled:
-                print(self._cov_to_R_string(self.should_have_assembled[name], 'red', offset, 1.7, 0.25), file=f)
+                f.write(self._cov_to_R_string(self.should_have_assembled[name], 'red', offset, 1.7, 0.25) + '\n')
 
-            print(self._cov_to_R_string(self.ref_pos_not_covered_by_contigs[name], 'black', offset, 2, 0.25), file=f)
-        print(vertical_lines, file=f)
+            f.write(self._cov_to_R_string(self.ref_pos_not_covered_by_contigs[name], 'black', offset, 2, 0.25) + '\n')
+        f.write(vertical_lines + '\n')
 
         # ----------- read depth on reference plot --------------
         self._write_ref_coverage_to_files_for_R(self.outprefix + '.read_coverage_on_ref')
-        print('fwd_ref_cov = scan("', self.outprefix + '.read_coverage_on_ref.fwd', '")', sep='', file=f)
-        print('rev_ref_cov = scan("', self.outprefix + '.read_coverage_on_ref.rev', '")', sep='', file=f)
-        print('par(mar=c(5, 4, 0, 0.5))', file=f)
-        print('plot(fwd_ref_cov, type="l", xlim=c(0, length(fwd_ref_cov) + 1), ylim=c(-max(rev_ref_cov), max(fwd_ref_cov)), col="blue", frame.plot=F, ylab="Read depth", xlab="Position in reference")', file=f)
-        print('lines(-rev_ref_cov, col="blue")', file=f)
-        print('abline(h=0, lty=2)', file=f)
-        print(vertical_lines, file=f)
-
-        print('dev.off()', file=f)
-        pyfastaq.utils.close(f)
+        f.write('fwd_ref_cov = scan("{}.read_coverage_on_ref.fwd")\n'.format(self.outprefix))
+        f.write('rev_ref_cov = scan("{}.read_coverage_on_ref.rev")\n'.format(self.outprefix))
+        f.write('par(mar=c(5, 4, 0, 0.5))\n')
+        f.write('plot(fwd_ref_cov, type="l", xlim=c(0, length(fwd_ref_cov) + 1), ylim=c(-max(rev_ref_cov), max(fwd_ref_cov)), col="blue", frame.plot=F, ylab="Read depth", xlab="Position in reference")\n')
+        f.write('lines(-rev_ref_cov, col="blue")\n')
+        f.write('abline(h=0, lty=2)\n')
+        f.write(vertical_lines + '\n')
+
+        f.write('dev.off()\n')
+        f_out = pyfastaq.utils.open_file_write(r_script)
+        f_out.write(f.getvalue())
+        pyfastaq.utils.close(f_out)
         iva.common.syscall('R CMD BATCH ' + r_script)
 
 
@@ -118,6 +118,17 @@ class TestMapping(unittest.TestCase):
         self.assertListEqual(cov, expected)
        
 
+    def test_get_bam_coverage(self):
+        '''Test get_bam_coverage'''
+        bam = os.path.join(data_dir, 'mapping_test.smalt.out.sorted.bam')
+        for rev, both_strands, suffix in [(False, False, 'fwd'), (True, False, 'rev'), (False, True, 'fwd_and_rev')]:
+            cov = mapping.get_bam_coverage(bam, {'ref': 190}, rev=rev, verbose=3, both_strands=both_strands)
+            f = open(os.path.join(data_dir, 'mapping_test.smalt.out.sorted.bam.' + suffix + '.cov'), 'rb')
+            expected = pickle.load(f)
+            f.close()
+            self.assertEqual({'ref': expected}, cov)
+
+
     def test_remove_indels(self):
         '''Test _remove_indels'''
         self.assertEqual('acgt', ''.join(mapping._remove_indels(list('ac+1Xgt'), '+')))
@@ -31,8 +31,15 @@ class TestMummer(unittest.TestCase):
 
     def test_swap(self):
         ''' test swap'''
-        # TODO
-        pass
+        m = mummer.NucmerHit('\t'.join(['1', '100', '11', '60', '100', '50', '100.00', '1000', '500', '1', '1', 'ref', 'qry']))
+        self.assertEqual(pyfastaq.intervals.Interval(10, 59), m.qry_coords())
+        self.assertEqual(pyfastaq.intervals.Interval(0, 99), m.ref_coords())
+        m._swap()
+        self.assertEqual(pyfastaq.intervals.Interval(0, 99), m.qry_coords())
+        self.assertEqual(pyfastaq.intervals.Interval(10, 59), m.ref_coords())
+        self.assertEqual('qry', m.ref_name)
+        self.assertEqual('ref', m.qry_name)
+        self.assertEqual(mummer.NucmerHit('\t'.join(['11', '60', '1', '100', '50', '100', '100.00', '500', '1000', '1', '1', 'qry', 'ref'])), m)
 
 
     def test_sort(self):
@@ -43,8 +50,15 @@ class TestMummer(unittest.TestCase):
 
     def test_file_read(self):
         '''test file_read'''
-        # TODO
-        pass
+        expected = [
+            mummer.NucmerHit('\t'.join(['1', '100', '51', '150', '100', '100', '100.00', '1008', '762', '1', '1', 'ref1', 'qry1'])),
+            mummer.NucmerHit('\t'.join(['300', '500', '351', '550', '100', '100', '100.00', '1008', '762', '1', '1', 'ref2', 'qry1'])),
+            mummer.NucmerHit('\t'.join(['1', '1000', '1', '1000', '1000', '1000', '100.00', '1000', '1542', '1', '1', 'ref2', 'qry2'])),
+        ]
+        got = list(mummer.file_reader(os.path.join(data_dir, 'mummer_test.file_reader.coords')))
+        self.assertEqual(expected, got)
+        # qc keeps the hits without copying them, so each one must be a new object
+        self.assertEqual(len(got), len(set(id(x) for x in got)))
 
 
     def test_qry_coords(self):
@@ -57,6 +71,13 @@ class TestMummer(unittest.TestCase):
             self.assertEqual(pyfastaq.intervals.Interval(0,99), m.qry_coords())
 
 
+    def test_coords_cached(self):
+        '''Test qry_coords and ref_coords are only made once'''
+        m = mummer.NucmerHit('\t'.join(['1', '100', '11', '60', '100', '50', '100.00', '1000', '500', '1', '1', 'ref', 'qry']))
+        self.assertIs(m.qry_coords(), m.qry_coords())
+        self.assertIs(m.ref_coords(), m.ref_coords())
+
+
     def test_ref_coords(self):
         '''Test ref_coords'''
         hits = ['\t'.join(['1', '100', '1', '100', '100', '100', '100.00', '1000', '1000', '1', '1', 'ref', 'ref']),
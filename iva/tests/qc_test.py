@@ -13,8 +13,10 @@
 # You should have received a copy of the GNU General Public License along with
 # this program. If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import concurrent.futures
 import os
 import filecmp
+import glob
 import pysam
 from iva import qc, mummer
 import pyfastaq
@@ -50,10 +52,112 @@ class TestQc(unittest.TestCase):
                 os.unlink(f)
 
 
-    def test_ids_in_order_from_fai(self):
-        '''test _ids_in_order_from_fai'''
-        expected = ['A0', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-        got = self.qc._ids_in_order_from_fai(os.path.join(data_dir, 'qc_test.reference.fa.fai'))
+    def test_deinterleave(self):
+        '''test _deinterleave'''
+        infile = os.path.join(data_dir, 'qc_test.reads.fq')
+        expected_1 = os.path.join(data_dir, 'qc_test.reads_1.fq')
+        expected_2 = os.path.join(data_dir, 'qc_test.reads_2.fq')
+        tmp_1 = 'tmp.deinterleave_1.fq'
+        tmp_2 = 'tmp.deinterleave_2.fq'
+
+        for threads, chunk_size in [(1, 67108864), (2, 67108864), (3, 10000)]:
+            qc._deinterleave(infile, tmp_1, tmp_2, threads=threads, chunk_size=chunk_size)
+            self.assertTrue(filecmp.cmp(expected_1, tmp_1, shallow=False))
+            self.assertTrue(filecmp.cmp(expected_2, tmp_2, shallow=False))
+            os.unlink(tmp_1)
+            os.unlink(tmp_2)
+
+        # CRLF line endings, '+name' separator lines and whitespace at the
+        # end of headers. Output should be the same whatever the number of threads
+        infile = os.path.join(data_dir, 'qc_test.deinterleave_messy.fq')
+        expected_1 = os.path.join(data_dir, 'qc_test.deinterleave_messy_1.fq')
+        expected_2 = os.path.join(data_dir, 'qc_test.deinterleave_messy_2.fq')
+        for threads, chunk_size in [(1, 67108864), (2, 67108864), (3, 10000)]:
+            qc._deinterleave(infile, tmp_1, tmp_2, threads=threads, chunk_size=chunk_size)
+            self.assertTrue(filecmp.cmp(expected_1, tmp_1, shallow=False))
+            self.assertTrue(filecmp.cmp(expected_2, tmp_2, shallow=False))
+            os.unlink(tmp_1)
+            os.unlink(tmp_2)
+
+        # a bad separator line should raise an error and not leave
+        # any temporary files behind
+        infile = 'tmp.deinterleave_bad.fq'
+        with open(os.path.join(data_dir, 'qc_test.reads.fq')) as f_in, open(infile, 'w') as f_out:
+            lines = f_in.readlines()
+            lines[-2] = 'x\n'
+            f_out.writelines(lines)
+        with self.assertRaises(qc.Error) as cm:
+            qc._deinterleave(infile, tmp_1, tmp_2, threads=2)
+        self.assertTrue(str(cm.exception).endswith('Got line:\nx\n'))
+        self.assertEqual([], glob.glob('tmp.deinterleave.*'))
+        os.unlink(infile)
+        for filename in [tmp_1, tmp_2]:
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+
+    def test_merge_overlapping_in_list(self):
+        '''test _merge_overlapping_in_list'''
+        l = [
+            pyfastaq.intervals.Interval(10, 20),
+            pyfastaq.intervals.Interval(1, 2),
+            pyfastaq.intervals.Interval(3, 4),
+            pyfastaq.intervals.Interval(30, 40),
+            pyfastaq.intervals.Interval(12, 15),
+            pyfastaq.intervals.Interval(15, 25),
+            pyfastaq.intervals.Interval(30, 40),
+        ]
+        qc._merge_overlapping_in_list(l)
+        expected = [
+            pyfastaq.intervals.Interval(1, 4),
+            pyfastaq.intervals.Interval(10, 25),
+            pyfastaq.intervals.Interval(30, 40),
+        ]
+        self.assertEqual(expected, l)
+        l = []
+        qc._merge_overlapping_in_list(l)
+        self.assertEqual([], l)
+
+
+    def test_length_sum_from_list(self):
+        '''test _length_sum_from_list'''
+        self.assertEqual(0, qc._length_sum_from_list([]))
+        self.assertEqual(13, qc._length_sum_from_list([pyfastaq.intervals.Interval(1, 2), pyfastaq.intervals.Interval(10, 20)]))
+
+
+    def test_fai_is_stale(self):
+        '''test _fai_is_stale'''
+        fasta = 'tmp.fai_is_stale.fa'
+        fai = fasta + '.fai'
+        with open(fasta, 'w') as f:
+            print('>seq', 'ACGT', sep='\n', file=f)
+        self.assertTrue(qc._fai_is_stale(fasta, fai))
+        with open(fai, 'w') as f:
+            print('seq', 4, 5, 4, 5, sep='\t', file=f)
+        os.utime(fasta, (1000, 1000))
+        os.utime(fai, (2000, 2000))
+        self.assertFalse(qc._fai_is_stale(fasta, fai))
+        os.utime(fai, (1000, 1000))
+        self.assertFalse(qc._fai_is_stale(fasta, fai))
+        os.utime(fasta, (3000, 3000))
+        self.assertTrue(qc._fai_is_stale(fasta, fai))
+        os.unlink(fasta)
+        os.unlink(fai)
+
+
+    def test_ids_and_lengths_from_fai(self):
+        '''test _ids_and_lengths_from_fai'''
+        expected_ids = ['A0', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
+        expected_lengths = {'A0': 240, 'A': 1027, 'B': 1778, 'C': 1413, 'D': 1565, 'E': 890, 'F': 2341, 'G': 2233, 'H': 2341}
+        got_ids, got_lengths = self.qc._ids_and_lengths_from_fai(os.path.join(data_dir, 'qc_test.reference.fa.fai'))
+        self.assertEqual(expected_ids, got_ids)
+        self.assertEqual(expected_lengths, got_lengths)
+
+
+    def test_lengths_from_fai(self):
+        '''test _lengths_from_fai'''
+        expected = {'A0': 240, 'A': 1027, 'B': 1778, 'C': 1413, 'D': 1565, 'E': 890, 'F': 2341, 'G': 2233, 'H': 2341}
+        got = self.qc._lengths_from_fai(os.path.join(data_dir, 'qc_test.reference.fa.fai'))
         self.assertEqual(expected, got)
 
 
@@ -135,9 +239,9 @@ class TestQc(unittest.TestCase):
 
     def test_has_orf(self):
         '''test _has_orf'''
-        fa = pyfastaq.sequences.Fasta('a', 'ggggTAAxTAAxTAATTAxTTAxTTAgg')
-        self.assertFalse(self.qc._has_orf(fa, 0, 30, 30))
-        self.assertTrue(self.qc._has_orf(fa, 0, 30, 20))
+        seq = 'ggggTAAxTAAxTAATTAxTTAxTTAgg'
+        self.assertFalse(self.qc._has_orf(seq, 30))
+        self.assertTrue(self.qc._has_orf(seq, 20))
 
 
     def test_calculate_cds_assembly_stats(self):
@@ -359,6 +463,7 @@ class TestQc(unittest.TestCase):
             [pyfastaq.intervals.Interval(0, 40)],
             [pyfastaq.intervals.Interval(10, 30)],
             [pyfastaq.intervals.Interval(5, 10), pyfastaq.intervals.Interval(20, 30)],
+            [pyfastaq.intervals.Interval(0, 4), pyfastaq.intervals.Interval(5, 10), pyfastaq.intervals.Interval(12, 41)],
         ]
         expected = [
             [pyfastaq.intervals.Interval(0, 41)],
@@ -367,6 +472,7 @@ class TestQc(unittest.TestCase):
             [pyfastaq.intervals.Interval(41, 41)],
             [pyfastaq.intervals.Interval(0, 9), pyfastaq.intervals.Interval(31, 41)],
             [pyfastaq.intervals.Interval(0, 4), pyfastaq.intervals.Interval(11, 19), pyfastaq.intervals.Interval(31, 41)],
+            [pyfastaq.intervals.Interval(11, 11)],
         ]
         assert len(coords) == len(expected)
         for i in range(len(coords)):
@@ -393,29 +499,6 @@ class TestQc(unittest.TestCase):
         self.assertEqual(expected['F'], self.qc.ref_pos_covered_by_contigs['F'])
 
 
-    def test_get_overlapping_qry_hits(self):
-        '''test _get_overlapping_qry_hits'''
-        h1 = mummer.NucmerHit('\t'.join(['1', '10', '1', '10', '100', '100', '100.00', '100', '100', '1', '+', 'ref1', 'qry1']))
-        h2 = mummer.NucmerHit('\t'.join(['1', '10', '21', '30', '100', '100', '100.00', '100', '100', '1', '+', 'ref1', 'qry1']))
-        h3 = mummer.NucmerHit('\t'.join(['1', '10', '25', '35', '100', '100', '100.00', '100', '100', '1', '+', 'ref1', 'qry1']))
-        h4 = mummer.NucmerHit('\t'.join(['1', '10', '29', '40', '100', '100', '100.00', '100', '100', '1', '+', 'ref1', 'qry1']))
-        h5 = mummer.NucmerHit('\t'.join(['1', '10', '70', '90', '100', '100', '100.00', '100', '100', '1', '+', 'ref1', 'qry1']))
-        hits = [h1, h2, h3, h4, h5]
-
-        expected = [
-            [],
-            [h3, h4],
-            [h2, h4],
-            [h2, h3],
-            []
-        ]
-
-        self.assertEqual(len(hits), len(expected))
-
-        for i in range(len(hits)):
-            self.assertEqual(self.qc._get_overlapping_qry_hits(hits, hits[i]), expected[i])
-
-
     def test_get_unique_and_repetitive_from_contig_hits(self):
         '''test _get_unique_and_repetitive_from_contig_hits'''
         h1 = mummer.NucmerHit('\t'.join(['1', '10', '1', '10', '100', '100', '100.00', '100', '100', '1', '+', 'ref1', 'qry1']))
@@ -430,6 +513,17 @@ class TestQc(unittest.TestCase):
         self.assertEqual(expect_unique, got_unique)
         self.assertEqual(expect_repetitive, got_repetitive)
 
+        # h7 and h8 do not overlap each other, but are both inside h6.
+        # h9 is next to h6, but does not overlap it
+        h6 = mummer.NucmerHit('\t'.join(['1', '10', '100', '1', '100', '100', '100.00', '100', '200', '1', '+', 'ref1', 'qry1']))
+        h7 = mummer.NucmerHit('\t'.join(['1', '10', '10', '20', '100', '100', '100.00', '100', '200', '1', '+', 'ref1', 'qry1']))
+        h8 = mummer.NucmerHit('\t'.join(['1', '10', '60', '50', '100', '100', '100.00', '100', '200', '1', '+', 'ref1', 'qry1']))
+        h9 = mummer.NucmerHit('\t'.join(['1', '10', '101', '150', '100', '100', '100.00', '100', '200', '1', '+', 'ref1', 'qry1']))
+        got_unique, got_repetitive  = self.qc._get_unique_and_repetitive_from_contig_hits([h9, h8, h7, h6])
+        self.assertEqual([h9], got_unique)
+        self.assertEqual([h8, h7, h6], got_repetitive)
+        self.assertEqual(([], []), self.qc._get_unique_and_repetitive_from_contig_hits([]))
+
 
     def test_contig_placement_in_reference(self):
         '''test _contig_placement_in_reference'''
@@ -478,6 +572,22 @@ class TestQc(unittest.TestCase):
         self.assertEqual(names, ['A:10-1017:+', 'B:1-1778:-', 'C:1-1413:+,E:1-200:-', 'D:1-1000:+', 'E:400-700:-', 'F:1-2341:-', 'F:1-2341:+'])
 
 
+    def test_get_R_plot_contig_order_from_contig_placement_repeated_contig(self):
+        '''test _get_R_plot_contig_order_from_contig_placement with a contig placed twice'''
+        # ctg1 hits twice, and should only be listed at its first position
+        self.qc.ref_length_offsets = {'ref1': 0, 'ref2': 100}
+        self.qc.contig_placement = {
+            'ctg1': [
+                (pyfastaq.intervals.Interval(0, 10), 'ref2', pyfastaq.intervals.Interval(5, 15), True, True),
+                (pyfastaq.intervals.Interval(20, 30), 'ref1', pyfastaq.intervals.Interval(50, 60), True, True),
+            ],
+            'ctg2': [(pyfastaq.intervals.Interval(0, 10), 'ref1', pyfastaq.intervals.Interval(10, 20), True, False)],
+            'ctg3': [(pyfastaq.intervals.Interval(0, 10), 'ref2', pyfastaq.intervals.Interval(0, 10), False, False)],
+        }
+        names = self.qc._get_R_plot_contig_order_from_contig_placement()
+        self.assertEqual(names, ['ctg2', 'ctg1', 'ctg3'])
+
+
     def test_calculate_ref_read_coverage(self):
         '''test _calculate_ref_read_coverage'''
         self.qc.ref_fasta = os.path.join(data_dir, 'qc_test.calculate_ref_read_coverage.ref.fa')
@@ -604,16 +714,19 @@ class TestQc(unittest.TestCase):
         self.assertEqual(self.qc.ref_coverage_rev, expected_rev)
 
 
-    def test_coverage_list_to_low_cov_intervals(self):
-        '''test _coverage_list_to_low_cov_intervals'''
-        l = [0, 1, 4, 5, 6, 6, 5, 0, 5, 6, 2, 1]
-        expected = [
-            pyfastaq.intervals.Interval(0,2),
-            pyfastaq.intervals.Interval(7,7),
-            pyfastaq.intervals.Interval(10,11),
-        ]
-        got = self.qc._coverage_list_to_low_cov_intervals(l)
-        self.assertEqual(expected, got)
+    def test_ref_read_region_coverage(self):
+        '''test _ref_read_region_coverage'''
+        self.qc.ref_coverage_fwd = {'ref1': [0, 1, 4, 5, 6, 6, 5, 0, 5, 6, 2, 1], 'ref2': [], 'ref3': [4]}
+        self.qc.ref_coverage_rev = {'ref1': [5, 1, 5, 5, 5, 5, 5, 5, 5, 5, 2, 5], 'ref2': [], 'ref3': [5]}
+        expected = (
+            [pyfastaq.intervals.Interval(0, 2), pyfastaq.intervals.Interval(7, 7), pyfastaq.intervals.Interval(10, 11)],
+            [pyfastaq.intervals.Interval(1, 1), pyfastaq.intervals.Interval(10, 10)],
+            [pyfastaq.intervals.Interval(3, 6), pyfastaq.intervals.Interval(8, 9)],
+            [pyfastaq.intervals.Interval(1, 1), pyfastaq.intervals.Interval(10, 10)],
+        )
+        self.assertEqual(expected, self.qc._ref_read_region_coverage('ref1'))
+        self.assertEqual(([], [], [], []), self.qc._ref_read_region_coverage('ref2'))
+        self.assertEqual(([pyfastaq.intervals.Interval(0, 0)], [], [], []), self.qc._ref_read_region_coverage('ref3'))
 
 
     def test_calculate_ref_read_region_coverage(self):
@@ -711,6 +824,33 @@ class TestQc(unittest.TestCase):
         self.assertEqual(expected, self.qc.should_have_assembled)
 
 
+    def test_raise_if_any_failed(self):
+        '''test _raise_if_any_failed'''
+        ok = concurrent.futures.Future()
+        ok.set_result(42)
+        running = concurrent.futures.Future()
+        cancelled = concurrent.futures.Future()
+        cancelled.cancel()
+        qc._raise_if_any_failed({})
+        qc._raise_if_any_failed({'ok': ok, 'running': running, 'cancelled': cancelled})
+        failed = concurrent.futures.Future()
+        failed.set_exception(qc.Error('oops'))
+        with self.assertRaises(qc.Error):
+            qc._raise_if_any_failed({'ok': ok, 'failed': failed})
+
+
+    def test_calculate_gage_and_ratt_stats_from_job(self):
+        '''test _calculate_gage_stats and _calculate_ratt_stats with a finished job'''
+        gage_job = concurrent.futures.Future()
+        gage_job.set_result({'Missing Reference Bases': 42})
+        self.qc._calculate_gage_stats(job=gage_job)
+        self.assertEqual({'Missing Reference Bases': 42}, self.qc.gage_stats)
+        ratt_job = concurrent.futures.Future()
+        ratt_job.set_result({'Gene models transferred': 3})
+        self.qc._calculate_ratt_stats(job=ratt_job)
+        self.assertEqual({'Gene models transferred': 3}, self.qc.ratt_stats)
+
+
     def test_contigs_and_bases_that_hit_ref(self):
         '''test _contigs_and_bases_that_hit_ref'''
         self.qc.assembly_vs_ref_mummer_hits = {